@@ -2,12 +2,23 @@ import logging
 import sys
 import argparse
 import subprocess
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from azure.identity import DefaultAzureCredential
+from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
 from azure.mgmt.containerregistry import ContainerRegistryManagementClient
+from azure.containerregistry.aio import ContainerRegistryClient as AsyncContainerRegistryClient
+from azure.core.exceptions import AzureError, HttpResponseError
+import asyncio
 import time
+import random
 import os
 import sqlite3
+import threading
+import functools
+import multiprocessing
+from collections import defaultdict
+from itertools import repeat
 from dotenv import load_dotenv
 
 
@@ -33,19 +44,36 @@ GCR_PROJECT_ID = os.getenv("GCR_PROJECT_ID")
 GCR_REGION = os.getenv("GCR_REGION")
 MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", 5))  # Default to 5 if not provided
 RETRY_LIMIT = int(os.getenv("RETRY_LIMIT", 3))  # Default to 3 if not provided
+ACR_FETCH_CONCURRENCY = int(os.getenv("ACR_FETCH_CONCURRENCY", 32))  # Default to 32 concurrent ACR requests if not provided
+
+
+# Process pool running every gcrane copy, created once in __main__
+GCRANE_POOL = None
 
 
 DB_FILE = "processed.db"
 
 
+# Single SQLite connection, opened by init_db(); every statement runs under _DB_LOCK
+_CONN = None
+_DB_LOCK = threading.Lock()
+# Processed entries waiting to be written by _flush_pending()
+_pending = []
+# In-memory copy of processed_entries, loaded by init_db() for O(1) lookups
+_processed_set = set()
+
+
 def init_db():
    """Initialize the SQLite database and create the necessary table."""
-   conn = sqlite3.connect(DB_FILE)
-   cursor = conn.cursor()
+   global _CONN
+   _CONN = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+   _CONN.executescript(
+       "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA busy_timeout=30000; PRAGMA temp_store=MEMORY;"
+   )
 
 
    # Create table if it doesn't exist
-   cursor.execute('''
+   _CONN.execute('''
        CREATE TABLE IF NOT EXISTS processed_entries (
            acr_name TEXT,
            repository TEXT,
@@ -56,77 +84,70 @@ def init_db():
    ''')
 
 
-   conn.commit()
-   conn.close()
+   _processed_set.update(
+       _CONN.execute('SELECT acr_name, repository, tag, digest FROM processed_entries').fetchall()
+   )
 
 
 def insert_processed(acr_name, repo, tag, digest):
    """Insert a processed entry into the SQLite database."""
-   conn = sqlite3.connect(DB_FILE)
-   cursor = conn.cursor()
+   with _DB_LOCK:
+       _processed_set.add((acr_name, repo, tag, digest))
+       _CONN.execute('''
+           INSERT OR IGNORE INTO processed_entries (acr_name, repository, tag, digest)
+           VALUES (?, ?, ?, ?)
+       ''', (acr_name, repo, tag, digest))
 
 
-   cursor.execute('''
-       INSERT OR IGNORE INTO processed_entries (acr_name, repository, tag, digest)
-       VALUES (?, ?, ?, ?)
-   ''', (acr_name, repo, tag, digest))
+def queue_processed(acr_name, repo, tag, digest):
+   """Queue a processed entry to be written on the next _flush_pending() call."""
+   with _DB_LOCK:
+       _processed_set.add((acr_name, repo, tag, digest))
+       _pending.append((acr_name, repo, tag, digest))
 
 
-   conn.commit()
-   conn.close()
+def _flush_pending():
+   """Write all queued processed entries to the database in a single transaction."""
+   with _DB_LOCK:
+       if not _pending:
+           return
+       _CONN.execute("BEGIN IMMEDIATE")
+       try:
+           _CONN.executemany('''
+               INSERT OR IGNORE INTO processed_entries (acr_name, repository, tag, digest)
+               VALUES (?, ?, ?, ?)
+           ''', _pending)
+           _CONN.execute("COMMIT")
+       except Exception:
+           _CONN.execute("ROLLBACK")
+           raise
+       _pending.clear()
 
 
 def check_if_processed(acr_name, repo, tag, digest):
    """Check if an entry exists in the processed table."""
-   conn = sqlite3.connect(DB_FILE)
-   cursor = conn.cursor()
-
-
-   cursor.execute('''
-       SELECT EXISTS(
-           SELECT 1 FROM processed_entries
-           WHERE acr_name = ? AND repository = ? AND tag = ? AND digest = ?
-       )
-   ''', (acr_name, repo, tag, digest))
-
-
-   result = cursor.fetchone()[0]
-   conn.close()
-
-
-   return result == 1
+   return (acr_name, repo, tag, digest) in _processed_set
 
 
 def get_all_processed():
    """Retrieve all processed entries from the database."""
-   conn = sqlite3.connect(DB_FILE)
-   cursor = conn.cursor()
-
-
-   cursor.execute('SELECT * FROM processed_entries')
-   rows = cursor.fetchall()
-  
-   conn.close()
-   return rows
+   with _DB_LOCK:
+       return _CONN.execute('SELECT * FROM processed_entries').fetchall()
 
 
 def clear_all_processed():
    """Clear all processed entries from the database."""
-   conn = sqlite3.connect(DB_FILE)
-   cursor = conn.cursor()
-
-
-   cursor.execute('DELETE FROM processed_entries')
+   with _DB_LOCK:
+       _processed_set.clear()
+       _CONN.execute('DELETE FROM processed_entries')
 
 
-   conn.commit()
-   conn.close()
 
 
-
-
-# Function to get the default Azure subscription ID using Azure CLI
+# Function to get the default Azure subscription ID, falling back to Azure CLI when not set in the environment
 def get_azure_subscription_id():
+   if os.getenv("AZURE_SUBSCRIPTION_ID"):
+       return os.getenv("AZURE_SUBSCRIPTION_ID")
    try:
        subscription_id = subprocess.check_output(
            ["az", "account", "list", "--query", "[?isDefault].id", "-o", "tsv"]
@@ -137,17 +158,66 @@ def get_azure_subscription_id():
        return None
 
 
-# Retry decorator for functions
+# HTTP statuses that will not succeed on retry, so the retry decorator fails fast on them
+NON_RETRYABLE_STATUS_CODES = {401, 403, 404}
+MAX_RETRY_DELAY = 60
+# gcrane stderr markers for auth and missing-image failures that a retry cannot fix
+NON_RETRYABLE_GCRANE_ERRORS = ("UNAUTHORIZED", "DENIED", "NOT_FOUND", "MANIFEST_UNKNOWN")
+
+
+class GcraneError(Exception):
+   """Raised when a gcrane command exits non-zero."""
+   def __init__(self, message, stderr):
+       super().__init__(f"{message}: {stderr}")
+       self.permanent = any(marker in stderr for marker in NON_RETRYABLE_GCRANE_ERRORS)
+
+
+def is_non_retryable(error):
+   """Return True for errors that will fail the same way on every attempt."""
+   if isinstance(error, GcraneError):
+       return error.permanent
+   return isinstance(error, HttpResponseError) and error.status_code in NON_RETRYABLE_STATUS_CODES
+
+
+def backoff_delay(delay, attempt):
+   """Exponential backoff with full jitter, capped at MAX_RETRY_DELAY."""
+   return random.uniform(0, min(MAX_RETRY_DELAY, delay * (2 ** attempt)))
+
+
+# Retry decorator for functions, with exponential backoff and full jitter
 def retry(retries=RETRY_LIMIT, delay=2):
    def decorator(func):
+       @functools.wraps(func)
        def wrapper(*args, **kwargs):
            for i in range(retries):
                try:
                    return func(*args, **kwargs)
                except Exception as e:
+                   if is_non_retryable(e):
+                       logging.error(f"Function {func.__name__} failed with non-retryable error: {e}")
+                       return None
+                   if i + 1 < retries:
+                       logging.warning(f"Retrying due to: {e}, attempt {i+1}/{retries}")
+                       time.sleep(backoff_delay(delay, i))
+                   else:
+                       logging.error(f"Function {func.__name__} failed after {retries} retries: {e}")
+       return wrapper
+   return decorator
+
+
+# Retry decorator for coroutines; same backoff as retry(), but re-raises the last error so callers can handle it
+def async_retry(retries=RETRY_LIMIT, delay=2):
+   def decorator(func):
+       @functools.wraps(func)
+       async def wrapper(*args, **kwargs):
+           for i in range(retries):
+               try:
+                   return await func(*args, **kwargs)
+               except Exception as e:
+                   if is_non_retryable(e) or i + 1 == retries:
+                       raise
                    logging.warning(f"Retrying due to: {e}, attempt {i+1}/{retries}")
-                   time.sleep(delay)
-           logging.error(f"Function {func.__name__} failed after {retries} retries")
+                   await asyncio.sleep(backoff_delay(delay, i))
        return wrapper
    return decorator
 
@@ -164,7 +234,8 @@ client = ContainerRegistryManagementClient(credential, subscription_id)
 
 @retry()
 def list_acr_registries():
-   return [registry.name for registry in client.registries.list()]
+   """Return (name, resource group) pairs for every ACR, parsed from each registry's resource id."""
+   return [(registry.name, registry.id.split('/resourceGroups/')[1].split('/')[0]) for registry in client.registries.list()]
 
 
 @retry()
@@ -177,68 +248,81 @@ def get_acr_credentials(acr_name, resource_group_name):
        raise
 
 
-@retry()
-def get_resource_group_name(acr_name):
-   try:
-       resource_group = subprocess.check_output(
-           ["az", "acr", "show", "--name", acr_name, "--query", "resourceGroup", "--output", "tsv"]
-       ).decode().strip()
-       return resource_group
-   except subprocess.CalledProcessError as e:
-       logging.error(f"Failed to fetch the resource group name for ACR {acr_name}: {e}")
-       return None
+@async_retry()
+async def list_repository_names(registry_client):
+   return [repo async for repo in registry_client.list_repository_names()]
 
 
-@retry()
-def list_repositories(acr_name):
-   return subprocess.check_output(["az", "acr", "repository", "list", "--name", acr_name, "--output", "tsv"]).decode().split()
+@async_retry()
+async def get_tag_digests(registry_client, repo):
+   """Retrieve a {tag: digest} mapping for every tagged manifest in a repository."""
+   return {
+       tag: manifest.digest
+       async for manifest in registry_client.list_manifest_properties(repo)
+       for tag in manifest.tags or []
+   }
 
 
-@retry()
-def list_tags(acr_name, repo):
-   return subprocess.check_output(["az", "acr", "repository", "show-tags", "--name", acr_name, "--repository", repo, "--output", "tsv"]).decode().split()
+async def fetch_all_tag_digests(acr_name):
+   """Yield (repo, {tag: digest}) for every repository in an ACR, fetching repositories concurrently."""
+   semaphore = asyncio.Semaphore(ACR_FETCH_CONCURRENCY)
+   async with AsyncDefaultAzureCredential() as async_credential, AsyncContainerRegistryClient(
+       endpoint=f"https://{acr_name}.azurecr.io", credential=async_credential
+   ) as registry_client:
 
 
-@retry()
-def get_tag_digest(acr_name, repo, tag):
-   """Retrieve the digest for a specific tag in a repository."""
-   try:
-       digest = subprocess.check_output(
-           ["az", "acr", "manifest", "list-metadata", "-r", acr_name, "-n", repo, "--query", f"[?tags[?contains(@, '{tag}')]].digest", "--output", "tsv" , "--only-show-errors"]
-       ).decode().strip()
-       return digest
-   except subprocess.CalledProcessError as e:
-       logging.error(f"Failed to get digest for {acr_name}/{repo}:{tag}: {e}")
-       return None
+       async def fetch_repo(repo):
+           async with semaphore:
+               try:
+                   return repo, await get_tag_digests(registry_client, repo)
+               except AzureError as e:
+                   # One failing repository must not stop the rest of the ACR
+                   logging.error(f"Failed to get digests for {acr_name}/{repo}: {e}")
+                   return repo, None
 
 
-@retry()
-def create_gcr_repository(repo_name):
-   """Try to create GCR repository and handle the 'already exists' error directly."""
-   command = [
-       "gcloud", "artifacts", "repositories", "create", repo_name,
-       "--repository-format=docker", "--location=us",
-       "--description", f"Repository for {repo_name}"
-   ]
-   result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+       try:
+           repositories = await list_repository_names(registry_client)
+       except AzureError as e:
+           logging.error(f"Failed to list repositories for {acr_name}: {e}")
+           return
+       for result in asyncio.as_completed([fetch_repo(repo) for repo in repositories]):
+           yield await result
 
 
-   if result.returncode == 0:
-       logging.info(f"Successfully created repository {repo_name}")
-   elif "ALREADY_EXISTS" in result.stderr.decode():
-       logging.info(f"Repository {repo_name} already exists. Skipping creation.")
-   else:
-       logging.error(f"Failed to create repository {repo_name}: {result.stderr.decode()}")
+# Destination repositories known to exist: pre-listed once in __main__, then extended as they are created
+_gar_created = set()
+# Destination repositories whose creation failed, so they are not retried once per image
+_gar_failed = set()
+_gar_created_lock = threading.Lock()
 
 
 @retry()
 def copy_image(source_image, dest_image):
-   command = f"gcrane cp {source_image} {dest_image}"
-   result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+   command = ["gcrane", "cp", source_image, dest_image]
+   result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
    if result.returncode == 0:
        logging.info(f"Successfully copied {source_image} to {dest_image}")
-   else:
-       logging.error(f"Failed to copy {source_image} to {dest_image}: {result.stderr.decode()}")
+       return True
+   # Raise so retry() backs off on transient failures; it returns None once attempts run out
+   raise GcraneError(f"Failed to copy {source_image} to {dest_image}", result.stderr.decode())
+
+
+@retry()
+def tag_image(dest_image, tag):
+   command = ["gcrane", "tag", dest_image, tag]
+   result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+   if result.returncode == 0:
+       logging.info(f"Successfully tagged {dest_image} as {tag}")
+       return True
+   raise GcraneError(f"Failed to tag {dest_image} as {tag}", result.stderr.decode())
+
+
+def copy_digest(source_repo, dest_repo, tags):
+   """Copy one digest under its first tag, alias the other tags to it, and return the tags that were placed."""
+   if not copy_image(f"{source_repo}:{tags[0]}", f"{dest_repo}:{tags[0]}"):
+       return []
+   return [tags[0]] + [tag for tag in tags[1:] if tag_image(f"{dest_repo}:{tags[0]}", tag)]
 
 
 def load_processed():
@@ -255,18 +339,15 @@ def save_processed(acr_name, repo, tag, digest):
        f.write(f"{acr_name}/{repo}:{tag}:{digest}\n")
 
 
-def process_repository(acr_name, repo):
+def process_repository(acr_name, repo, tag_digests):
    try:
-       tags = list_tags(acr_name, repo)
-       dest_repo_name = f"{acr_name}"
-       create_gcr_repository(dest_repo_name)
-
+       if tag_digests is None:
+           logging.error(f"Skipping {acr_name}/{repo} due to missing digests.")
+           return
 
-       for tag in tags:
-           digest = get_tag_digest(acr_name, repo, tag)
-           if not digest:
-               logging.error(f"Skipping {acr_name}/{repo}:{tag} due to missing digest.")
-               continue
+       # Group the unprocessed tags by digest so each manifest is only pushed once
+       by_digest = defaultdict(list)
+       for tag, digest in tag_digests.items():
 
 
            # Check if this repository:tag:digest has been processed before using SQLite
@@ -275,63 +356,106 @@ def process_repository(acr_name, repo):
                continue
 
 
-           with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS) as executor:
-               futures = [
-                   executor.submit(copy_image, f"{acr_name}.azurecr.io/{repo}:{tag}", f"{GCR_REGION}-docker.pkg.dev/{GCR_PROJECT_ID}/{acr_name}/{repo}:{tag}")
-               ]
-               for future in as_completed(futures):
-                   future.result()  # This will raise any exceptions caught during image copy
+           by_digest[digest].append(tag)
+
+
+       source_repo = f"{acr_name}.azurecr.io/{repo}"
+       dest_repo = f"{GCR_REGION}-docker.pkg.dev/{GCR_PROJECT_ID}/{acr_name}/{repo}"
+       # Batch small jobs per worker to amortise pickling, without starving the pool on small repositories
+       chunksize = max(1, min(16, len(by_digest) // MAX_CONCURRENT_JOBS))
+       results = GCRANE_POOL.map(
+           copy_digest, repeat(source_repo), repeat(dest_repo), by_digest.values(), chunksize=chunksize
+       )
+
+
+       for digest, copied_tags in zip(by_digest, results):
+           # After successfully processing the repository:tag:digest, queue it for SQLite
+           for tag in copied_tags:
+               queue_processed(acr_name, repo, tag, digest)
 
 
-           # After successfully processing the repository:tag:digest, save it in SQLite
-           insert_processed(acr_name, repo, tag, digest)
+       _flush_pending()
    except Exception as exc:
        logging.error(f"Error processing repository {repo}: {exc}")
 
 
-def process_acr(acr_name):
-   resource_group_name = get_resource_group_name(acr_name)
+def process_acr(acr_name, resource_group_name):
    if not resource_group_name:
        logging.error(f"Skipping ACR {acr_name} due to missing resource group name")
        return
 
 
-   repositories = list_repositories(acr_name)
-   #print("repsostiroes ares:", repositories)
-   for repo in repositories:
-       # print( "*****************repo is ", repo)
-       # print("********** processed files are" ,processed)
-       process_repository(acr_name, repo)
+   # Every repository in this ACR lands in the same destination repository, so create it once up front
+   if not ensure_gar_repository(GCR_PROJECT_ID, acr_name):
+       logging.error(f"Skipping ACR {acr_name} due to missing destination repository")
+       return
+
+
+   async def submit_repositories(executor):
+       # Hand each repository to the executor as soon as its digests arrive, while the remaining fetches stay in flight
+       return [
+           executor.submit(process_repository, acr_name, repo, tag_digests)
+           async for repo, tag_digests in fetch_all_tag_digests(acr_name)
+       ]
+
+
+   # Repositories run side by side; their copies all share GCRANE_POOL
+   with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS) as executor:
+       futures = asyncio.run(submit_repositories(executor))
+       for future in as_completed(futures):
+           future.result()
 
 
 def chunkify(lst, n):
    return [lst[i:i + n] for i in range(0, len(lst), n)]
 
 
-def ensure_gar_repository(project_id, repository_name):
+def list_gar_repositories(project_id):
+  """Return the names of every GAR repository in GCR_REGION with a single gcloud call."""
   try:
-      # Check if the repository exists
       result = subprocess.run(
           ["gcloud", "artifacts", "repositories", "list",
            "--project", project_id, "--location", GCR_REGION,
-           "--filter", f"name:projects/{project_id}/locations/{GCR_REGION}/repositories/{repository_name}",
-           "--format", "value(name)"], capture_output=True, text=True, check=True
+           "--format", "json"], capture_output=True, text=True, check=True
       )
-      # If repository doesn't exist, it creates it
-      if not result.stdout.strip():
-          print(f"Creating repository {repository_name} in project {project_id}.")
-          subprocess.run(
-              ["gcloud", "artifacts", "repositories", "create", repository_name,
-               "--repository-format=docker",
-               "--location", location,
-               "--project", project_id],
-              check=True
-          )
-          print(f"Repository {repository_name} created.")
-      else:
-          print(f"Repository {repository_name} already exists.")
+      return {repository['name'].split('/')[-1] for repository in json.loads(result.stdout)}
   except subprocess.CalledProcessError as e:
-      print(f"An error occurred while checking or creating the repository: {e}")
+      print(f"An error occurred while listing repositories: {e}")
+      return set()
+
+
+def ensure_gar_repository(project_id, repository_name):
+  """Create the GAR repository unless it is already known; return whether it exists."""
+  with _gar_created_lock:
+      # Repositories were pre-listed at startup, so only unknown ones need a gcloud call
+      if repository_name in _gar_created:
+          return True
+      if repository_name in _gar_failed:
+          return False
+
+
+  # Run gcloud outside the lock so threads whose repository already exists are not held up
+  print(f"Creating repository {repository_name} in project {project_id}.")
+  result = subprocess.run(
+      ["gcloud", "artifacts", "repositories", "create", repository_name,
+       "--repository-format=docker",
+       "--location", GCR_REGION,
+       "--project", project_id],
+      capture_output=True, text=True
+  )
+  created = result.returncode == 0 or "ALREADY_EXISTS" in result.stderr
+  with _gar_created_lock:
+      if created:
+          _gar_created.add(repository_name)
+      else:
+          _gar_failed.add(repository_name)
+  if result.returncode == 0:
+      print(f"Repository {repository_name} created.")
+  elif created:
+      print(f"Repository {repository_name} already exists.")
+  else:
+      print(f"An error occurred while creating the repository {repository_name}: {result.stderr}")
+  return created
 
 def copy_images_to_gcr(difference_file):
    try:
@@ -340,28 +464,28 @@ def copy_images_to_gcr(difference_file):
        if not original_images:
            print("No images to copy.")
            return
-        with ThreadPoolExecutor() as executor:
-           futures = []
-           for original_image in original_images:
-               original_image = original_image.strip()
-               parts = original_image.split(':')
-               if len(parts) >= 3:
-                   repo_name = parts[0]
-                   ensure_gar_repository(GCR_PROJECT_ID, repo_name)
-                   azure_registry = f"{parts[0]}.azurecr.io"
-                   image_path_with_tag = f"{parts[1]}:{parts[2]}"
-                   source_image = f"{azure_registry}/{image_path_with_tag}"
-                   destination_image = f"{GCR_REGION}-docker.pkg.dev/{GCR_PROJECT_ID}/{parts[0]}/{image_path_with_tag}"
-                 
-                   futures.append(executor.submit(copy_image, source_image, destination_image))
+       futures = []
+       for original_image in original_images:
+           original_image = original_image.strip()
+           parts = original_image.split(':')
+           if len(parts) >= 3:
+               repo_name = parts[0]
+               if not ensure_gar_repository(GCR_PROJECT_ID, repo_name):
+                   continue
+               azure_registry = f"{parts[0]}.azurecr.io"
+               image_path_with_tag = f"{parts[1]}:{parts[2]}"
+               source_image = f"{azure_registry}/{image_path_with_tag}"
+               destination_image = f"{GCR_REGION}-docker.pkg.dev/{GCR_PROJECT_ID}/{parts[0]}/{image_path_with_tag}"
+             
+               futures.append(GCRANE_POOL.submit(copy_image, source_image, destination_image))
 
 
       
-           for future in as_completed(futures):
-               try:
-                   future.result()
-               except Exception as e:
-                   print(f"An error occurred during image copy: {e}")
+       for future in as_completed(futures):
+           try:
+               future.result()
+           except Exception as e:
+               print(f"An error occurred during image copy: {e}")
 
 
        Image = original_image.split(':')
@@ -388,26 +512,37 @@ if __name__ == "__main__":
    args = parser.parse_args()
 
 
+   init_db()
+   # Fork every worker now, before any ACR/repository threads or event loops exist, so they neither
+   # inherit a multi-threaded parent nor re-import this script (and redo the Azure setup) under forkserver
+   GCRANE_POOL = ProcessPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, mp_context=multiprocessing.get_context("fork"))
+   GCRANE_POOL.submit(int).result()
+   _gar_created.update(list_gar_repositories(GCR_PROJECT_ID))
    if args.diff_file:
        if os.path.isfile(args.diff_file):
            copy_images_to_gcr(args.diff_file)
+           GCRANE_POOL.shutdown()
        else:
            print(f"Error: The path provided is not a valid file: {args.diff_file}")
            sys.exit(1)
    else:
-       init_db()
-       acr_names = list_acr_registries()
-       chunks = chunkify(acr_names, MAX_CONCURRENT_JOBS)
-
-
-       for chunk in chunks:
-           with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS) as executor:
-               futures = [executor.submit(process_acr, acr_name) for acr_name in chunk]
-               for future in as_completed(futures):
-                   try:
-                       future.result()
-                   except Exception as exc:
-                       logging.error(f"Error processing ACR: {exc}")
+       acr_registries = list_acr_registries()
+       chunks = chunkify(acr_registries, MAX_CONCURRENT_JOBS)
+
+
+       try:
+           for chunk in chunks:
+               with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS) as executor:
+                   futures = [executor.submit(process_acr, acr_name, resource_group_name) for acr_name, resource_group_name in chunk]
+                   for future in as_completed(futures):
+                       try:
+                           future.result()
+                       except Exception as exc:
+                           logging.error(f"Error processing ACR: {exc}")
+       finally:
+           # Persist anything queued by a repository that failed before flushing
+           _flush_pending()
+           GCRANE_POOL.shutdown()
 
 
        logging.info("Finished processing all ACRs")
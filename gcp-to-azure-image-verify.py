@@ -2,8 +2,15 @@ import subprocess
 import json
 import os
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
+from azure.identity import DefaultAzureCredential
+from azure.mgmt.containerregistry import ContainerRegistryManagementClient
+from azure.core.exceptions import AzureError
+import google.auth
+from google.cloud import artifactregistry_v1
+from google.api_core.exceptions import GoogleAPIError
+from google.auth.exceptions import DefaultCredentialsError
 
 
 
@@ -14,6 +21,8 @@ difference_output_file = "difference_images.txt"
 destination_registry = "us-docker.pkg.dev"
 location = "us"
 project_id = "apac-inmobi-internal"
+# Registry listing is bound on az/gcloud subprocesses, not CPU, so size the pool like the default thread pool
+max_workers = min(32, (os.cpu_count() or 1) + 4)
 
 
 
@@ -39,13 +48,17 @@ def remove_old_files():
 
 def get_all_artifact_registries():
   try:
-      cmd = "gcloud artifacts repositories list --format=json"
-      proc = subprocess.run(cmd, shell=True, capture_output=True, text=True, check=True)
-      output = proc.stdout.strip()
-      return json.loads(output)
-  except subprocess.CalledProcessError as e:
+      # Use the active project (GOOGLE_CLOUD_PROJECT, ADC or gcloud config), as `gcloud artifacts repositories list` did
+      _, active_project_id = google.auth.default()
+      if not active_project_id:
+          print("Error listing Artifact Registries: no active Google Cloud project is configured.")
+          return []
+      client = artifactregistry_v1.ArtifactRegistryClient()
+      repositories = client.list_repositories(parent=f"projects/{active_project_id}/locations/-")
+      return [repository.name for repository in repositories]
+  except (GoogleAPIError, DefaultCredentialsError) as e:
       print("Error listing Artifact Registries:")
-      print(e.stderr)
+      print(e)
       return []
 
 
@@ -125,9 +138,9 @@ def list_docker_images_for_repository(location, project_id, repository_id):
 
 def write_images_to_file(image_list, filename):
   try:
-      with open(filename, 'w') as file:
-          for image in image_list:
-              file.write(f"{image}\n")
+      # Build the whole file in memory and write it with a single call, sorted for compare_registries
+      with open(filename, 'wb') as file:
+          file.write(b''.join(image.encode() + b'\n' for image in sorted(image_list)))
       print(f"Image list has been written to {filename}")
   except IOError as e:
       print(f"Failed to write to the file: {filename}")
@@ -136,27 +149,35 @@ def write_images_to_file(image_list, filename):
 
 
 
-def get_gar():
-  registries = get_all_artifact_registries()
-  all_images = []
+def map_chunksize(item_count):
+  # Batch items to cut pickling round-trips, but never so much that workers sit idle
+  return max(1, min(16, item_count // max_workers))
 
 
 
 
-  def process_registry(registry):
-      location = registry.get('name').split('/')[3]
-      project_id = registry.get('name').split('/')[1]
-      repository_id = registry.get('name').split('/')[-1]
-      return list_docker_images_for_repository(location, project_id, repository_id)
+# Module level so ProcessPoolExecutor can pickle it
+def process_gar_registry(registry_name):
+  location = registry_name.split('/')[3]
+  project_id = registry_name.split('/')[1]
+  repository_id = registry_name.split('/')[-1]
+  return list_docker_images_for_repository(location, project_id, repository_id)
 
 
 
 
-  with ThreadPoolExecutor() as executor:
-      results = list(tqdm(executor.map(process_registry, registries), total=len(registries), desc="Fetching GCP Images"))
+def get_gar():
+  registries = get_all_artifact_registries()
+  all_images = []
+
+
+
+
+  with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      results = list(tqdm(executor.map(process_gar_registry, registries, chunksize=map_chunksize(len(registries))), total=len(registries), desc="Fetching GCP Images"))
       for images in results:
           all_images.extend(images)
-   write_images_to_file(all_images, gcr_output_file)
+  write_images_to_file(all_images, gcr_output_file)
 
 
 
@@ -166,14 +187,31 @@ def get_gar():
 
 
 
-def get_all_acr_names():
+def get_azure_subscription_id():
+  # Prefer the environment, otherwise use the Azure CLI's default subscription like `az acr list` did
+  if os.getenv("AZURE_SUBSCRIPTION_ID"):
+      return os.getenv("AZURE_SUBSCRIPTION_ID")
   try:
-      cmd = "az acr list --query '[].name' --output json"
-      proc = subprocess.run(cmd, shell=True, capture_output=True, text=True, check=True)
-      return json.loads(proc.stdout)
+      proc = subprocess.run(["az", "account", "list", "--query", "[?isDefault].id", "-o", "tsv"], capture_output=True, text=True, check=True)
+      return proc.stdout.strip()
   except subprocess.CalledProcessError as e:
-      print("Error listing Azure Container Registries:")
+      print("Error fetching the Azure subscription ID:")
       print(e.stderr)
+      return None
+
+
+
+
+def get_all_acr_names():
+  subscription_id = get_azure_subscription_id()
+  if not subscription_id:
+      return []
+  try:
+      client = ContainerRegistryManagementClient(DefaultAzureCredential(), subscription_id)
+      return [registry.name for registry in client.registries.list()]
+  except AzureError as e:
+      print("Error listing Azure Container Registries:")
+      print(e)
       return []
 
 
@@ -191,23 +229,17 @@ def list_acr_images_with_digests(registry_name):
 
 
       for repo in repositories:
-          cmd_tags = f"az acr repository show-tags --name {registry_name} --repository {repo} --output json"
-          proc_tags = subprocess.run(cmd_tags, shell=True, capture_output=True, text=True, check=True)
-          tags = json.loads(proc_tags.stdout)
-
-
+          # One call returns every manifest with its tags, instead of one call per tag
+          cmd_manifests = ["az", "acr", "manifest", "list-metadata", "--registry", registry_name, "--name", repo, "--only-show-errors", "--output", "json"]
+          proc_manifests = subprocess.run(cmd_manifests, capture_output=True, text=True, check=True)
+          manifests = json.loads(proc_manifests.stdout)
 
 
-          for tag in tags:
-              cmd_manifest = f"az acr repository show-manifests --name {registry_name} --repository {repo} --query \"[?tags && contains(@.tags, '{tag}')].digest\" --output json"
-              proc_manifest = subprocess.run(cmd_manifest, shell=True, capture_output=True, text=True, check=True)
-              digests = json.loads(proc_manifest.stdout)
 
 
-
-
-              if digests:
-                  digest = digests[0]
+          for manifest in manifests:
+              digest = manifest.get('digest')
+              for tag in manifest.get('tags') or []:
                   image_identifier = f"{registry_name}:{repo}:{tag}:-{digest}"
                   image_list.append(image_identifier)
 
@@ -230,14 +262,8 @@ def get_acr():
 
 
 
-  def process_registry(registry_name):
-      return list_acr_images_with_digests(registry_name)
-
-
-
-
-  with ThreadPoolExecutor() as executor:
-      results = list(tqdm(executor.map(process_registry, acr_names), total=len(acr_names), desc="Fetching ACR Images"))
+  with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      results = list(tqdm(executor.map(list_acr_images_with_digests, acr_names, chunksize=map_chunksize(len(acr_names))), total=len(acr_names), desc="Fetching ACR Images"))
       for images in results:
           all_images.extend(images)
 
@@ -254,39 +280,50 @@ def get_acr():
 
 
 
-def read_images_from_file(filename):
+def read_sorted_lines(filename):
   try:
       with open(filename, 'r') as file:
-          return {line.strip() for line in file}
+          for line in file:
+              yield line.rstrip('\n')
   except IOError as e:
       print(f"Failed to read the file: {filename}")
       print(e)
-      return set()
 
 
-def read_images_from_file(file_path):
-  with open(file_path) as f:
-      images = set(line.strip() for line in f.readlines())
-  return images
+
+
+def sorted_difference(left_lines, right_lines):
+  """Yield the unique lines of left_lines missing from right_lines; both inputs must be sorted."""
+  right = next(right_lines, None)
+  previous = None
+  for left in left_lines:
+      if left == previous:
+          continue
+      previous = left
+      while right is not None and right < left:
+          right = next(right_lines, None)
+      if right != left:
+          yield left
 
 
 
 
 def compare_registries(acr_file, gcr_file, difference_file):
-  acr_images = read_images_from_file(acr_file)
-  gcr_images = read_images_from_file(gcr_file)
-  missing_in_acr = acr_images - gcr_images
-  if missing_in_acr:
-      print("Images missing in Google Container Registry:")
-      with open(difference_file, 'w') as f:
-          for image in missing_in_acr:
-              print(image)
-              f.write(image + '\n')
-          return True
+  # Both files are written sorted, so a lockstep merge finds the difference without loading either into memory
+  missing_count = 0
+  with open(difference_file, 'w') as f:
+      for image in sorted_difference(read_sorted_lines(acr_file), read_sorted_lines(gcr_file)):
+          if not missing_count:
+              print("Images missing in Google Container Registry:")
+          print(image)
+          f.write(image + '\n')
+          missing_count += 1
+  if missing_count:
+      return True
   else:
       print("No images are missing from Azure Container Registry compared to Google Artifact Registry.")
-      if os.path.exists(difference_output_file):
-          os.remove(difference_output_file)  # Clear the file if it exists
+      if os.path.exists(difference_file):
+          os.remove(difference_file)  # Clear the file if it exists
       return False  # No difference file created
 
 